@@ -9,44 +9,104 @@ of this license, visit http://creativecommons.org/licenses/by-nc-sa/4.0/.
 
 import os
 import sys
-import re
 import inspect
-import traceback
+import linecache
 import builtins
 import atexit
-import textwrap
-from concurrent.futures import ThreadPoolExecutor
 from typing import Literal
-from collections import namedtuple
 
 __main__ = sys.modules['__main__']
 
 class _Sane:
 
     VERSION = '7.1'
-    ANSI = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-    Context = namedtuple(
-        'Context', ('filename', 'lineno', 'code_context', 'index'))
-    Depends = namedtuple('Depends', ('value', 'context'))
-    Default = namedtuple('Default', ('func', 'context'))
+    VERSION_STRING = f'Sane v{VERSION}'
+    BOLD = '\x1b[1m'
+    DIM = '\x1b[2m'
+    RESET = '\x1b[0m'
+    YELLOW = '\x1b[33m'
+    MAGENTA = '\x1b[35m'
+    LOG_HEADER = f'{DIM}[log]{RESET} '
+    WARN_HEADER = f'{YELLOW}[warn]{RESET} '
+    ERROR_HEADER = f'{MAGENTA}[error] '
+    HINT_HEADER = DIM
+    FOOTER = f'{RESET}\n'
+    STYLES = {
+        'log': (DIM, RESET),
+        'warn': (YELLOW, RESET),
+        'error': (MAGENTA, RESET),
+        'hint': (DIM, RESET),
+    }
+    PLAIN_STYLES = dict.fromkeys(STYLES, ('', ''))
+    DEPENDS_KINDS = frozenset(('on_tag', 'on_cmd', 'on_task'))
+    POSITIONAL_KINDS = frozenset((inspect.Parameter.POSITIONAL_ONLY,
+                                  inspect.Parameter.POSITIONAL_OR_KEYWORD))
+
+    class Context:
+        __slots__ = ('filename', 'lineno')
+
+        def __init__(self, filename, lineno):
+            self.filename = filename
+            self.lineno = lineno
+
+    class Props:
+        __slots__ = ('type', 'inner', 'context', 'name', 'args', 'argcounts',
+                     'tags', 'resolved', 'depends_tag', 'depends_cmd',
+                     'depends_task', 'items')
+
+        def __init__(self, type_=None, inner=None):
+            self.type = type_
+            self.inner = inner
+            self.context = None
+            self.name = None
+            self.args = ()
+            self.argcounts = (0, 0)
+            self.tags = []
+            self.resolved = False
+            self.depends_tag = []
+            self.depends_cmd = []
+            self.depends_task = []
+            self.items = ()
+
+    class Default:
+        __slots__ = ('func', 'context')
+
+        def __init__(self, func, context):
+            self.func = func
+            self.context = context
+
+    FLAGS = {
+        '-nc': '--no-color', '--no-color': '--no-color',
+        '-c': '--color', '--color': '--color',
+        '-v': '--verbose', '--verbose': '--verbose',
+        '-h': '--help', '--help': '--help',
+        '--version': '--version',
+        '--list': '--list',
+    }
+
+    class Error(BaseException):
+        """An error in the sane program, reported once by `main`.
+
+        Like `SystemExit`, this is not an `Exception`, so that an `except
+        Exception` in a @cmd or @task cannot swallow it on its way to `main`.
+        """
 
-    singleton = None
+        def __init__(self, message, context=None, hints=()):
+            super().__init__(message)
+            self.context = context
+            self.hints = hints
 
-    @staticmethod
-    def strip_ansi(text):
-        return _Sane.ANSI.sub('', text)
+    singleton = None
 
     @staticmethod
     def get_context():
-        stack = inspect.stack(context=4)
-        for element in stack:
-            if element.frame.f_globals['__name__'] != __name__:
-                context = _Sane.Context(element.filename,
-                                        element.lineno,
-                                        element.code_context,
-                                        element.index)
-                stack.clear()
-                return context
+        # Walk up to the first frame outside of sane.
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_globals['__name__'] == __name__:
+            frame = frame.f_back
+        if frame is None:
+            return None
+        return _Sane.Context(frame.f_code.co_filename, frame.f_lineno)
 
     @staticmethod
     def get():
@@ -70,16 +130,37 @@ class _Sane:
         self.tasks = {}
         self.tags = {}
         self.operation = {}
-        self.incidence = {}
+        self.labels = {}
+        self.toposorts = {}
+        self.schedules = {}
+        self.dependencies = {}
+        self.jobs = 1
         self.thread_exe = None
+        self.thread_exe_busy = False
         self.script_name = self.get_script_name()
 
     def setup_logging(self):
         self.verbose = False
-        if os.environ.get('NO_COLOR', False) or not sys.stdout.isatty():
-            self.color = False
+        # NO_COLOR is honoured when set to a non-empty value (no-color.org),
+        # and settles the question without probing the terminal.
+        self.set_color(not os.environ.get('NO_COLOR') and sys.stdout.isatty())
+
+    def set_color(self, color):
+        self.color = color
+        if color:
+            self.styles = _Sane.STYLES
+            self.log_header = _Sane.LOG_HEADER
+            self.warn_header = _Sane.WARN_HEADER
+            self.error_header = _Sane.ERROR_HEADER
+            self.hint_header = _Sane.HINT_HEADER
+            self.footer = _Sane.FOOTER
         else:
-            self.color = True
+            self.styles = _Sane.PLAIN_STYLES
+            self.log_header = '[log] '
+            self.warn_header = '[warn] '
+            self.error_header = ''
+            self.hint_header = ''
+            self.footer = '\n'
 
     def get_script_name(self):
         if hasattr(__main__, '__file__'):
@@ -89,20 +170,21 @@ class _Sane:
 
     def read_arguments(self):
         args = sys.argv[1:]
-        if '--' in args:
+        try:
             cmd_arg_limit = args.index('--')
-            if cmd_arg_limit == len(args):
-                self.usage_error()
-            sane_args = list(args[:cmd_arg_limit])
-            cmd_args = tuple(args[cmd_arg_limit + 1:])
-        else:
-            sane_args = list(args)
+        except ValueError:
+            sane_args = args
             cmd_args = None
+        else:
+            sane_args = args[:cmd_arg_limit]
+            cmd_args = tuple(args[cmd_arg_limit + 1:])
 
-        color = self.get_cmdline_flag(sane_args, '-nc', '--no-color')
-        no_color = self.get_cmdline_flag(sane_args, '-c', '--color')
-        verbose = self.get_cmdline_flag(sane_args, '-v', '--verbose')
-        help_ = self.get_cmdline_flag(sane_args, '-h', '--help')
+        options, sane_args = self.parse_sane_args(sane_args)
+
+        color = '--color' in options
+        no_color = '--no-color' in options
+        verbose = '--verbose' in options
+        help_ = '--help' in options
 
         if color and no_color:
             self.usage_error()
@@ -111,31 +193,41 @@ class _Sane:
         if verbose:
             self.verbose = True
         if no_color:
-            self.color = False
+            self.set_color(False)
         if color:
-            self.color = True
+            self.set_color(True)
 
         if help_:
             if verbose:
                 import pydoc
                 pydoc.pager(self.get_manual())
             else:
-                print(self.get_long_usage())
+                sys.stdout.write(f'{self.get_long_usage()}\n')
             self.finalized = True
             sys.exit(0)
 
-        if '--list' in sane_args:
-            if cmd_args is not None or len(sane_args) != 1:
+        if '--version' in options:
+            extraneous = ('--list' in options or '--jobs' in options or
+                          len(sane_args) > 0)
+            if cmd_args is not None or extraneous:
+                self.usage_error()
+            sys.stdout.write(f'{_Sane.VERSION_STRING}\n')
+            self.finalized = True
+            sys.exit(0)
+
+        if '--list' in options:
+            extraneous = '--jobs' in options or len(sane_args) > 0
+            if cmd_args is not None or extraneous:
                 self.usage_error()
             self.operation = {'mode': 'list'}
         else:
-            self.setup_jobs(sane_args)
+            self.setup_jobs(options.get('--jobs', None))
 
             if len(sane_args) > 0:
                 if len(sane_args) > 1:
                     self.hint('Have you forgot a -- before the @cmd\'s arguments?\n')
                     self.usage_error()
-                cmd = sane_args.pop()
+                cmd = sane_args[0]
                 if cmd.startswith('-'):
                     self.usage_error()
             else:
@@ -149,60 +241,42 @@ class _Sane:
                 'cmd': cmd,
                 'args': cmd_args,
             }
+
+    def parse_sane_args(self, args):
+        options = {}
+        positional = []
+        args = iter(args)
+        for arg in args:
+            if arg in _Sane.FLAGS:
+                option, value = _Sane.FLAGS[arg], True
+            elif arg in ('--jobs', '-j'):
+                option, value = '--jobs', next(args, None)
+                if value is None:
+                    self.usage_error()
+            elif arg.startswith(('--jobs=', '-j=')):
+                option, value = '--jobs', arg.partition('=')[2]
+            else:
+                positional.append(arg)
+                continue
+            if option in options:
+                self.usage_error()
+            options[option] = value
+        return options, positional
     
-    def setup_jobs(self, args):
-        jobs = self.get_cmdline_value(args, '--jobs', '-j')
+    def setup_jobs(self, jobs):
         if jobs is not None:
             try:
-                jobs = int(jobs)
-                if jobs == 1:
-                    self.thread_exe = None
-                elif jobs == 0:
-                    self.thread_exe = ThreadPoolExecutor(max_workers=None)
-                else:
-                    self.thread_exe = ThreadPoolExecutor(max_workers=jobs)
+                self.jobs = int(jobs)
             except ValueError:
                 self.error('--jobs must be a number.')
                 self.usage_error()
-
-    def get_cmdline_flag(self, args, short, long_):
-        has_short = (short in args)
-        has_long = (long_ in args)
-        if has_short and has_long:
-            self.usage_error()
-        else:
-            is_set = False
-            if has_short:
-                args.remove(short)
-                is_set = True
-            elif has_long:
-                args.remove(long_)
-                is_set = True
-            return is_set
-
-    def get_cmdline_value(self, args, long_, short):
-        for i in range(len(args)):
-            arg = args[i]
-            has_long = arg.startswith(long_)
-            has_short = arg.startswith(short)
-            if has_long or has_short:
-                if has_short:
-                    remaining = arg.removeprefix(short)
-                else:
-                    remaining = arg.removeprefix(long_)
-                if remaining.startswith('='):
-                    args.remove(arg)
-                    return remaining.removeprefix('=')
-                elif len(remaining) == 0:
-                    if i < len(args) - 1:
-                        value = args[i+1]
-                        args.remove(arg)
-                        args.remove(value)
-                        return value
+            if self.jobs < 0:
+                self.error('--jobs must not be negative.')
+                self.usage_error()
 
     def usage_error(self):
         self.finalized = True
-        print(self.get_short_usage(), file=sys.stderr)
+        sys.stderr.write(f'{self.get_short_usage()}\n')
         sys.exit(1)
 
     def get_short_usage(self):
@@ -772,9 +846,9 @@ class _Sane:
         manipulation of the singleton's state).
         
         Finally, note that whenever an object is augmented with sane-relevant
-        metadata, this metadata is stored in a `dict` attribute named
-        `__sane__`. Inspection of this dictionary at different points of
-        execution may help with understanding sane's operation.
+        metadata, this metadata is stored in an attribute named `__sane__`.
+        Inspection of this attribute at different points of execution may help
+        with understanding sane's operation.
         
         ## Sane's license terms
 
@@ -853,6 +927,7 @@ class _Sane:
             self.error('@cmd cannot appear after sane().')
             self.show_context(context, 'error')
             self.hint('(Move sane() to the end of the file.)')
+            sys.exit(1)
 
         if len(args) > 1 or len(kwargs) > 0:
             self.error('@cmd does not take arguments.')
@@ -871,7 +946,7 @@ class _Sane:
             self.show_context(context, 'error')
             sys.exit(1)
 
-        self.ensure_positional_args_only(context, func)
+        arg_names, argcounts = self.ensure_positional_args_only(context, func)
         self.ensure_no_tags(func, context)
         
         if not hasattr(func, '__name__'):
@@ -881,7 +956,7 @@ class _Sane:
             sys.exit(1)
 
         if func.__name__ in self.cmds:
-            other_, other_context = self.cmds[func.__name__]
+            other_context = self.cmds[func.__name__].__sane__.context
             self.error('@cmd names must be unique.')
             self.show_context(context, 'error')
             self.show_context(other_context, 'hint')
@@ -895,10 +970,13 @@ class _Sane:
             self.hint(
                 '(A function can only have a single @cmd or @task decorator.)')
             sys.exit(1)
-        props['type'] = 'cmd'
-        props['context'] = context
+        props.type = 'cmd'
+        props.context = context
+        props.name = self.make_name(func)
+        props.args = arg_names
+        props.argcounts = argcounts
 
-        def cmd(*args, **kwargs):
+        def cmd(*args):
             if not self.finalized:
                 context = _Sane.get_context()
                 self.warn('Calling a @cmd from outside other '
@@ -908,7 +986,7 @@ class _Sane:
             else:
                 return self.run_tree(func, args)
 
-        cmd.__dict__['__sane__'] = {'type': 'wrapper', 'inner': func}
+        cmd.__sane__ = _Sane.Props('wrapper', func)
         self.cmds[func.__name__] = func
         return cmd
 
@@ -940,8 +1018,9 @@ class _Sane:
 
         if self.finalized:
             self.error('@task cannot appear after sane().')
-            self.show_context(context)
+            self.show_context(context, 'error')
             self.hint('(Move sane() to the end of the file.)')
+            sys.exit(1)
 
         if len(args) > 1 or len(kwargs) > 0:
             self.error('@task does not take arguments.')
@@ -969,8 +1048,9 @@ class _Sane:
             self.hint(
                 '(A function can only have a single @cmd or @task decorator.)')
             sys.exit(1)
-        props['type'] = 'task'
-        props['context'] = context
+        props.type = 'task'
+        props.context = context
+        props.name = self.make_name(func)
 
         def task():
             if not self.finalized:
@@ -982,7 +1062,7 @@ class _Sane:
             else:
                 return self.run_tree(func, ())
 
-        task.__dict__['__sane__'] = {'type': 'wrapper', 'inner': func}
+        task.__sane__ = _Sane.Props('wrapper', func)
         self.tasks.setdefault(func.__name__, []).append(func)
         return task
 
@@ -1062,8 +1142,7 @@ class _Sane:
             self.hint('(Use on_tag=, on_cmd=, or on_task=.)')
             sys.exit(1)
 
-        given = list(arg for arg in ('on_tag', 'on_cmd',
-                     'on_task') if arg in args.keys())
+        given = _Sane.DEPENDS_KINDS & args.keys()
         if len(given) != 1:
             self.error(
                 '@depends must take a single on_tag=, on_cmd=, or on_task=.')
@@ -1071,7 +1150,7 @@ class _Sane:
             self.hint('(If you wish to have multiple dependencies, '
                       'use multiple @depends decorators.)')
             sys.exit(1)
-        given = given[0]
+        given, = given
 
         def specific_decorator(func):
             if self.is_task_or_cmd(func):
@@ -1091,35 +1170,22 @@ class _Sane:
     def depends_on_tag(self, context, func, **args):
         if len(args) != 1:
             self.error('@depends(on_tag=...) does not take other arguments.')
-            self.show_context(context)
+            self.show_context(context, 'error')
             sys.exit(1)
 
-        tag = []
         arg = args['on_tag']
-        if type(arg) is str:
-            tag.append(_Sane.Depends(arg, context))
+        if isinstance(arg, str):
+            tag = [(sys.intern(str(arg)), context)]
         elif hasattr(arg, '__iter__'):
-            if type(arg) not in (tuple, list, set):
-                if type(arg) is dict:
-                    self.warn('on_tag= argument is a dictionary, which, although iterable, '
-                              'is ambiguous, since only the values (and not the keys) will '
-                              'be considered. The values will still be considered, but '
-                              'this may be unexpected.')
-                else:
-                    self.warn('on_tag= argument is not a collection, although it is iterable. '
-                              'The elements in this iterator will still be considered, '
-                              'but exhaustion of the iterator may produce unexpected results.')
-                self.show_context(context, 'warn')
-                self.hint(
-                    '(To silence this warning, convert the argument to a collection type.)')
+            if not isinstance(arg, (tuple, list, set)):
+                self.warn_not_collection(arg, 'on_tag= argument', context)
+                arg = list(arg)
 
-            for element in arg:
-                if type(element) is str:
-                    tag.append(_Sane.Depends(element, context))
-                else:
-                    self.error('on_tag= argument must be string or iterable of string.')
-                    self.show_context(context, 'error')
-                    sys.exit(1)
+            if not all(isinstance(element, str) for element in arg):
+                self.error('on_tag= argument must be string or iterable of string.')
+                self.show_context(context, 'error')
+                sys.exit(1)
+            tag = [(sys.intern(str(element)), context) for element in arg]
         else:
             self.error(
                 'on_tag= argument must be string or iterable of string.')
@@ -1127,7 +1193,7 @@ class _Sane:
             sys.exit(1)
 
         props = self.get_props(func)
-        props['depends']['tag'].extend(tag)
+        props.depends_tag.extend(tag)
 
         return func
 
@@ -1146,43 +1212,37 @@ class _Sane:
         cmd = args['on_cmd']
         args = args['args']
 
-        if type(args) not in (tuple, list):
-            if type(args) is str:
+        if not isinstance(args, (tuple, list)):
+            if isinstance(args, str):
                 self.error('The args= argument must be a tuple or list.')
                 self.show_context(context, 'error')
                 self.hint(f'Write args=["{args}"] instead.')
+                sys.exit(1)
             elif hasattr(args, '__iter__'):
-                if type(args) is dict:
-                    self.warn('The args= argument is a dictionary, which, although iterable, '
-                              'is ambiguous, since only the values (and not the keys) will '
-                              'be considered. The values will still be considered, but '
-                              'this may be unexpected.')
-                else:
-                    self.warn('The args= argument is not a collection, although it is iterable. '
-                              'The elements in this iterator will still be considered, '
-                              'but exhaustion of the iterator may produce unexpected results.')
-                self.show_context(context, 'warn')
-                self.hint(
-                    '(To silence this warning, convert the argument to a collection type.)')
-                args = list(args)
+                self.warn_not_collection(args, 'The args= argument', context)
             else:
                 self.error('The args= argument must be a tuple or list.')
                 self.show_context(context, 'error')
+                sys.exit(1)
+        # The arguments are part of the (func, args) graph items, and so must
+        # be hashable.
+        args = tuple(args)
 
-        if type(cmd) is not str:
+        if not isinstance(cmd, str):
             if hasattr(cmd, '__call__'):
-                if not hasattr(cmd, '__sane__'):
+                props = getattr(cmd, '__sane__', None)
+                if not isinstance(props, _Sane.Props):
                     self.error('Given function is not a @cmd.')
                     self.show_context(context, 'error')
                     self.hint('(Is the referenced function missing a @cmd?)')
                     sys.exit(1)
-                elif cmd.__sane__.get('type', None) != 'wrapper':
+                elif props.type != 'wrapper':
                     self.error('Given function is not decorated with @cmd.')
                     self.show_context(context, 'error')
                     self.hint('(Add a @cmd before the other decorators.)')
                     sys.exit(1)
-                cmd = cmd.__sane__['inner']
-                if cmd.__sane__['type'] != 'cmd':
+                cmd = props.inner
+                if cmd.__sane__.type != 'cmd':
                     self.error('Given function is not a @cmd.')
                     self.show_context(context, 'error')
                     self.hint('(Did you mean @depends(on_task=...)?)')
@@ -1192,10 +1252,13 @@ class _Sane:
                     'on_cmd= argument must be a cmd, or the name of a cmd.')
                 self.show_context(context, 'error')
                 sys.exit(1)
+        else:
+            # Names are interned, so that resolving them compares by identity.
+            cmd = sys.intern(str(cmd))
 
         props = self.get_props(func)
-        props['depends']['cmd'].append(
-            _Sane.Depends((cmd, args), context))
+        props.depends_cmd.append(
+            ((cmd, args), context))
 
         # Resolution of `cmd` and validation of `args` happens at graph build stage.
 
@@ -1215,20 +1278,21 @@ class _Sane:
 
         task = args['on_task']
 
-        if type(task) is not str:
+        if not isinstance(task, str):
             if hasattr(task, '__call__'):
-                if not hasattr(task, '__sane__'):
+                props = getattr(task, '__sane__', None)
+                if not isinstance(props, _Sane.Props):
                     self.error('Given function is not a @task.')
                     self.show_context(context, 'error')
                     self.hint('(Is the referenced function missing a @task?)')
                     sys.exit(1)
-                elif task.__sane__.get('type', None) != 'wrapper':
+                elif props.type != 'wrapper':
                     self.error('Given function is not decorated with @task.')
                     self.show_context(context, 'error')
                     self.hint('(Add a @task before the other decorators.)')
                     sys.exit(1)
-                task = task.__sane__['inner']
-                if task.__sane__['type'] != 'task':
+                task = props.inner
+                if task.__sane__.type != 'task':
                     self.error('Given function is not a @task.')
                     self.show_context(context, 'error')
                     self.hint('(Did you mean @depends(on_cmd=...)?)')
@@ -1238,9 +1302,11 @@ class _Sane:
                     'on_task= argument must be a task, or the name of a task.')
                 self.show_context(context, 'error')
                 sys.exit(1)
+        else:
+            task = sys.intern(str(task))
 
         props = self.get_props(func)
-        props['depends']['task'].append(_Sane.Depends(task, context))
+        props.depends_task.append((task, context))
 
         # Resolution of task happens at graph build stage.
 
@@ -1288,32 +1354,19 @@ class _Sane:
             sys.exit(1)
 
         tag = args[0]
-        tags = []
-        if type(tag) is str:
-            tags.append(tag)
+        if isinstance(tag, str):
+            tags = [sys.intern(str(tag))]
         elif hasattr(tag, '__iter__'):
-            if type(tag) not in (tuple, list, set):
-                if type(tag) is dict:
-                    self.warn('@tag\'s argument is a dictionary, which, although iterable, '
-                              'is ambiguous, since only the values (and not the keys) will '
-                              'be considered. The values will still be considered, but '
-                              'this may be unexpected.')
-                else:
-                    self.warn('@tag\'s argument is not a collection, although it is iterable. '
-                              'The elements in this iterator will still be considered, '
-                              'but exhaustion of the iterator may produce unexpected results.')
-                self.show_context(context, 'warn')
-                self.hint(
-                    '(To silence this warning, convert the argument to a collection type.)')
+            if not isinstance(tag, (tuple, list, set)):
+                self.warn_not_collection(tag, '@tag\'s argument', context)
+                tag = list(tag)
 
-            for element in tag:
-                if type(element) is str:
-                    tags.append(element)
-                else:
-                    self.error('@tag\'s argument must be string or iterable of string.')
-                    self.show_context(context, 'error')
-                    self.hint('(For example, @tag(\'foo\') or @tag([\'a\', \'b\']).)')
-                    sys.exit(1)
+            if not all(isinstance(element, str) for element in tag):
+                self.error('@tag\'s argument must be string or iterable of string.')
+                self.show_context(context, 'error')
+                self.hint('(For example, @tag(\'foo\') or @tag([\'a\', \'b\']).)')
+                sys.exit(1)
+            tags = [sys.intern(str(element)) for element in tag]
         else:
             self.error(
                 'tag\'s argument must be string or iterable of string.')
@@ -1327,13 +1380,27 @@ class _Sane:
                 self.show_context(context, 'error')
                 sys.exit(1)
             props = self.get_props(func)
-            props['tags'].extend(tags)
+            props.tags.extend(tags)
             for tag in tags:
                 self.tags.setdefault(tag, []).append(func)
             return func
 
         return specific_decorator
 
+    def warn_not_collection(self, arg, name, context):
+        if isinstance(arg, dict):
+            self.warn(f'{name} is a dictionary, which, although iterable, '
+                      'is ambiguous, since only the values (and not the keys) will '
+                      'be considered. The values will still be considered, but '
+                      'this may be unexpected.')
+        else:
+            self.warn(f'{name} is not a collection, although it is iterable. '
+                      'The elements in this iterator will still be considered, '
+                      'but exhaustion of the iterator may produce unexpected results.')
+        self.show_context(context, 'warn')
+        self.hint(
+            '(To silence this warning, convert the argument to a collection type.)')
+
     def default_decorator(self, *args, **kwargs):
         if len(args) > 1 or len(kwargs) > 0:
             self.error('@default does not take arguments.')
@@ -1356,8 +1423,9 @@ class _Sane:
             sys.exit(1)
 
         func = args[0]
-        position_incorrect = (not hasattr(func, '__sane__') or
-                              func.__sane__['type'] is None)
+        props = getattr(func, '__sane__', None)
+        position_incorrect = (not isinstance(props, _Sane.Props) or
+                              props.type is None)
 
         if position_incorrect:
             self.error('@default must come before @cmd.')
@@ -1366,7 +1434,7 @@ class _Sane:
                       'or move @default to come before @cmd.)')
             sys.exit(1)
 
-        type_ = func.__sane__['type']
+        type_ = props.type
         if type_ == 'cmd':
             self.error('@default must come before @cmd.')
             self.show_context(context, 'error')
@@ -1374,7 +1442,7 @@ class _Sane:
             sys.exit(1)
         else:
             if type_ == 'wrapper':
-                type_ = func.__sane__['inner'].__sane__['type']
+                type_ = props.inner.__sane__.type
             if type_ == 'task':
                 self.error('@default cannot be used with @task.')
                 self.show_context(context, 'error')
@@ -1383,7 +1451,7 @@ class _Sane:
             elif type_ != 'cmd':
                 raise ValueError(type_)
 
-        self.default = _Sane.Default(func.__sane__['inner'], context)
+        self.default = _Sane.Default(props.inner, context)
         return func
 
     def run_on_exit(self):
@@ -1416,7 +1484,18 @@ class _Sane:
         if self.exit_code or self.finalized:
             return
         self.finalized = True
-        
+
+        try:
+            try:
+                self.run_operation()
+            finally:
+                if self.thread_exe is not None:
+                    self.thread_exe.shutdown()
+        except _Sane.Error as error:
+            self.report(error)
+            sys.exit(1)
+
+    def run_operation(self):
         self.ensure_not_magic_and_parallel()
 
         op_mode = self.operation['mode']
@@ -1428,440 +1507,457 @@ class _Sane:
 
             if cmd is None:
                 if self.default is None:
-                    self.error(
-                        'No @cmd given, and no @default @cmd exists.')
-                    self.hint(
-                        '(Add @default to a @cmd to run it when no @cmd is specified.)')
-                    self.hint(
-                        '(If you need help getting started with sane, run '
-                        f'\'{self.script_name} --verbose --help)\'.')
-                    sys.exit(1)
+                    raise _Sane.Error(
+                        'No @cmd given, and no @default @cmd exists.',
+                        hints=('(Add @default to a @cmd to run it when no @cmd is specified.)',
+                               '(If you need help getting started with sane, run '
+                               f'\'{self.script_name} --verbose --help)\'.'))
                 cmd = self.default.func
             else:
                 if cmd not in self.cmds:
-                    self.error(f'No @cmd named {cmd}.')
-                    self.hint('(Use --list to see all available @cmds.)')
-                    sys.exit(1)
+                    raise _Sane.Error(
+                        f'No @cmd named {cmd}.',
+                        hints=('(Use --list to see all available @cmds.)',))
                 cmd = self.cmds[cmd]
                 
                 if not self.is_signature_compatible(cmd, args):
-                    context = cmd.__sane__['context']
                     str_cmd = self.get_name(cmd)
                     str_args = self.get_str_args(cmd)
-                    self.error(f'Wrong number of arguments for {str_cmd}({str_args}).')
-                    self.show_context(context, 'error')
-                    sys.exit(1)
+                    raise _Sane.Error(
+                        f'Wrong number of arguments for {str_cmd}({str_args}).',
+                        cmd.__sane__.context)
 
             self.run_tree(cmd, args)
 
-        if self.thread_exe is not None:
-            self.thread_exe.shutdown()
+    def report(self, error):
+        self.error(str(error))
+        if error.context is not None:
+            self.show_context(error.context, 'error')
+        for hint in error.hints:
+            self.hint(hint)
 
     def list_cmds(self):
+        if self.color:
+            bold, dim, reset = _Sane.BOLD, _Sane.DIM, _Sane.RESET
+        else:
+            bold = dim = reset = ''
+
+        lines = []
         for cmd_name, cmd in self.cmds.items():
-            self.print(f'\x1b[1m{cmd_name}\x1b[0m', end='')
+            lines.append(f'{bold}{cmd_name}{reset}')
 
             if self.verbose:
                 str_cmd_args = self.get_str_args(cmd)
                 if str_cmd_args:
-                    self.print(f'\x1b[2m({str_cmd_args})\x1b[0m')
+                    lines.append(f'{dim}({str_cmd_args}){reset}\n')
                 else:
-                    self.print('\n  \x1b[2m(No arguments.)\x1b[0m')
+                    lines.append(f'\n  {dim}(No arguments.){reset}\n')
 
                 if hasattr(cmd, '__doc__') and cmd.__doc__:
                     doc = cmd.__doc__
                     for line in doc.splitlines():
-                        self.print(f'\x1b[2m  {line}\x1b[0m')
+                        lines.append(f'{dim}  {line}{reset}\n')
                 else:
-                    self.print('  \x1b[2mNo information given.\x1b[0m')
+                    lines.append(f'  {dim}No information given.{reset}\n')
             else:
-                self.print('\n', end='')
+                lines.append('\n')
+
+        sys.stdout.write(''.join(lines))
 
     def run_tree(self, func, args):
-        self.update_graph(func, args)
-        toposort = self.get_toposort(func, args)
-        for slice_ in toposort[:-1]:
-            if self.thread_exe is None:
-                for func, args in slice_:
-                    if self.verbose:
-                        str_func = self.get_name(func)
-                        str_args = ', '.join(str(x) for x in args)
-                        self.log(f'Running {str_func}({str_args})')
-
-                    try:
-                        (self.catch_thread_exception(func))(*args)
-                    except Exception as e:
-                        self.report_func_failed(func, e)
-            else:
-                if self.verbose:
-                    str_jobs = []
-                    for func, args in slice_:
-                        str_func = self.get_name(func)
-                        str_args = ', '.join(str(x) for x in args)
-                        str_jobs.append(f'{str_func}({str_args})')
-                    if len(str_jobs) > 1:
-                        str_jobs = ', '.join(
-                            str_jobs[:-1]) + ', and ' + str_jobs[-1]
-                        self.log(f'Simultaneously running {str_jobs}.')
-                    else:
-                        str_jobs = str_jobs[0]
-                        self.log(f'Running {str_jobs}.')
-
-                futures = (self.thread_exe.submit(
-                            self.catch_thread_exception(func), *args)
-                           for func, args in slice_)
-                for future in futures:
-                    try:
-                        future.result()
-                    except Exception as e:
-                        self.report_func_failed(func, e)
-
-        func, args = toposort[-1][0]
+        if len(self.get_dependencies(func)) > 0:
+            self.run_dependencies(func, args)
+
         if self.verbose:
-            str_func = self.get_name(func)
-            str_args = ', '.join(str(x) for x in args)
-            self.log(f'Running {str_func}({str_args})')
+            self.log(f'Running {self.get_label(func, args)}')
 
         try:
-            return self.catch_thread_exception(func)(*args)
+            return self.call_job(func, args)
         except Exception as e:
             self.report_func_failed(func, e)
-    
+
+    def run_dependencies(self, func, args):
+        # The graph can no longer change once sane is running, so the plan for
+        # each (func, args) can be reused by later calls.
+        toposort = self.toposorts.get((func, args), None)
+        if toposort is None:
+            incidence = self.update_graph(func, args)
+            toposort = self.get_toposort(func, args, incidence)
+            self.toposorts[(func, args)] = toposort
+
+        if self.jobs == 1:
+            self.run_slices(toposort[:-1])
+        else:
+            schedule = self.schedules.get((func, args), None)
+            if schedule is None:
+                schedule = self.get_schedule(toposort[:-1])
+                self.schedules[(func, args)] = schedule
+            self.run_schedule(schedule)
+
+    def run_schedule(self, schedule):
+        from concurrent.futures import ThreadPoolExecutor
+        if self.thread_exe_busy:
+            # This is a nested call, coming from a @cmd or @task that is itself
+            # running in the shared pool; waiting on that same pool could
+            # starve it, so use a dedicated one.
+            with ThreadPoolExecutor(max_workers=self.jobs or None) as thread_exe:
+                self.run_graph(schedule, thread_exe)
+        else:
+            if self.thread_exe is None:
+                self.thread_exe = ThreadPoolExecutor(
+                    max_workers=self.jobs or None)
+            self.thread_exe_busy = True
+            try:
+                self.run_graph(schedule, self.thread_exe)
+            finally:
+                self.thread_exe_busy = False
+
+    def run_slices(self, slices):
+        for slice_ in slices:
+            for item in slice_:
+                func, args = item
+                if self.verbose:
+                    self.log(f'Running {self.get_label(func, args)}')
+                try:
+                    self.run_job(item)
+                except Exception as e:
+                    self.report_func_failed(func, e)
+
+    def get_schedule(self, slices):
+        items = [item for slice_ in slices for item in slice_]
+        index = {item: i for i, item in enumerate(items)}
+        counts = [0] * len(items)
+        dependents = [[] for _item in items]
+        for i, (func, _args) in enumerate(items):
+            dependencies = self.get_dependencies(func)
+            counts[i] = len(dependencies)
+            for dep_item in dependencies:
+                dependents[index[dep_item]].append(i)
+        return items, counts, dependents
+
+    def run_graph(self, schedule, thread_exe):
+        from concurrent.futures import wait, FIRST_COMPLETED
+        items, counts, dependents = schedule
+        remaining = counts.copy()
+        ready = [i for i, count in enumerate(counts) if count == 0]
+
+        futures = {}
+        while len(ready) > 0 or len(futures) > 0:
+            if len(ready) == 1 and len(futures) == 0:
+                i = ready.pop()
+                item = items[i]
+                if self.verbose:
+                    self.log_jobs((item,))
+                try:
+                    self.run_job(item)
+                except Exception as e:
+                    self.report_func_failed(item[0], e)
+                self.release_dependents(dependents[i], remaining, ready)
+                continue
+
+            if len(ready) > 0:
+                ready.sort()
+                if self.verbose:
+                    self.log_jobs([items[i] for i in ready])
+                for i in ready:
+                    futures[thread_exe.submit(self.run_job, items[i])] = i
+                ready = []
+
+            done, _pending = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    for pending in futures:
+                        pending.cancel()
+                    self.report_func_failed(items[i][0], e)
+                self.release_dependents(dependents[i], remaining, ready)
+
+    def release_dependents(self, dependents, remaining, ready):
+        for dependent in dependents:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+
+    def log_jobs(self, items):
+        str_jobs = [self.get_label(func, args) for func, args in items]
+        if len(str_jobs) > 1:
+            str_jobs = ', '.join(
+                str_jobs[:-1]) + ', and ' + str_jobs[-1]
+            self.log(f'Simultaneously running {str_jobs}.')
+        else:
+            self.log(f'Running {str_jobs[0]}.')
+
+    def run_job(self, item):
+        func, args = item
+        return self.call_job(func, args)
+
     def report_func_failed(self, func, exception):
-        context = func.__sane__['context']
+        import traceback
         name = self.get_name(func)
-        type_ = func.__sane__['type']
-        cmd_args = inspect.signature(cmd).parameters.keys()
+        type_ = func.__sane__.type
         lines = [f'Failed running @{type_} {name}.',
                  *traceback.format_exception(exception),
                  'Aborting.']
-        self.error('\n'.join(lines))
-        sys.exit(1)
+        raise _Sane.Error('\n'.join(lines))
 
-    def catch_thread_exception(self, inner):
-        def fn(*args, **kwargs):
-            try:
-                return inner(*args, **kwargs)
-            except RuntimeError as e:
-                lines = textwrap.wrap(
-                      'Due to limitations on the magic used to invoke sane, '
-                      'the @tasks and @cmds are executed after the interpreter '
-                      'has shut down, by use of the atexit module. Generally, '
-                      'the difference should not be noticeable --- and, at the '
-                      'time of writing, atexit defines no limitations as to '
-                      'what can be done in this regime --- but, in practice, '
-                      'some operations may be prevented. (In particular, '
-                      'concurrency is disallowed, although this behaviour is '
-                      'undocumented.)\n'
-                      'If you are encountering these limitations (which can '
-                      'easily happen if using external modules), consider '
-                      'disabling the magic behaviour by calling sane.sane() '
-                      'at the end of your program.',
-                      subsequent_indent='       ')
-                self.warn('\n'.join(lines))
-                raise e
-        return fn
+    def call_job(self, func, args):
+        try:
+            return func(*args)
+        except RuntimeError as e:
+            import textwrap
+            lines = textwrap.wrap(
+                  'Due to limitations on the magic used to invoke sane, '
+                  'the @tasks and @cmds are executed after the interpreter '
+                  'has shut down, by use of the atexit module. Generally, '
+                  'the difference should not be noticeable --- and, at the '
+                  'time of writing, atexit defines no limitations as to '
+                  'what can be done in this regime --- but, in practice, '
+                  'some operations may be prevented. (In particular, '
+                  'concurrency is disallowed, although this behaviour is '
+                  'undocumented.)\n'
+                  'If you are encountering these limitations (which can '
+                  'easily happen if using external modules), consider '
+                  'disabling the magic behaviour by calling sane.sane() '
+                  'at the end of your program.',
+                  subsequent_indent='       ')
+            self.warn('\n'.join(lines))
+            raise e
 
     def update_graph(self, func, args):
-        visiting = set()
-        stack = [('visit', (func, args))]
-        while len(stack) > 0:
-            op, item = stack.pop()
-            func, args = item
-            if op == 'visit':
-                if item in visiting:
-                    trace = self.get_trace(stack)
+        # Depth-first walk over the dependencies, keeping an iterator over the
+        # remaining dependencies of each function in the current path.
+        item = (func, args)
+        incidence = {}
+        visiting = {item}
+        path = [item]
+        pending = [iter(self.get_dependencies(func))]
+        while len(pending) > 0:
+            for dep_item in pending[-1]:
+                if dep_item in visiting:
+                    trace = self.get_trace(path, dep_item)
                     self.report_loop(trace)
 
-                visiting.add(item)
-                stack.append(('seal', item))
-
-                props = self.get_props(func)
-                self.resolve_depends(props)
-                for cmd_item, _context in props['depends']['cmd']:
-                    if cmd_item in self.incidence:
-                        self.incidence[cmd_item] += 1
-                    else:
-                        stack.append(('visit', cmd_item))
-                        self.incidence[cmd_item] = 1
-                for task, _context in props['depends']['task']:
-                    task_item = (task, ())
-                    if task_item in self.incidence:
-                        self.incidence[task_item] += 1
-                    else:
-                        stack.append(('visit', task_item))
-                        self.incidence[task_item] = 1
-                for tag, _context in props['depends']['tag']:
-                    for task in self.tags.get(tag, []):
-                        task_item = (task, ())
-                        if task_item in self.incidence:
-                            self.incidence[task_item] += 1
-                        else:
-                            stack.append(('visit', task_item))
-                            self.incidence[task_item] = 1
-            elif op == 'seal':
-                visiting.remove(item)
+                if dep_item in incidence:
+                    incidence[dep_item] += 1
+                else:
+                    incidence[dep_item] = 1
+                    dependencies = self.get_dependencies(dep_item[0])
+                    if len(dependencies) > 0:
+                        visiting.add(dep_item)
+                        path.append(dep_item)
+                        pending.append(iter(dependencies))
+                        break
             else:
-                raise ValueError(op)
+                pending.pop()
+                visiting.remove(path.pop())
+        return incidence
 
-    def get_toposort(self, func, args):
+    def get_dependencies(self, func):
+        dependencies = self.dependencies.get(func, None)
+        if dependencies is None:
+            props = self.get_props(func)
+            self.resolve_depends(props)
+            dependencies = props.items
+            self.dependencies[func] = dependencies
+        return dependencies
+
+    def get_toposort(self, func, args, incidence):
+        # NB: `incidence` is consumed.
         toposort = []
 
         roots = [(func, args)]
-        incidence = self.incidence.copy()
 
         while len(roots) > 0:
             toposort.append(roots)
             next_roots = []
             for func, args in roots:
-                props = self.get_props(func)
-                for cmd_item, _context in props['depends']['cmd']:
-                    incidence[cmd_item] -= 1
-                    if incidence[cmd_item] == 0:
-                        next_roots.append(cmd_item)
-                for task, _context in props['depends']['task']:
-                    task_item = (task, ())
-                    incidence[task_item] -= 1
-                    if incidence[task_item] == 0:
-                        next_roots.append(task_item)
-                for tag, context_ in props['depends']['tag']:
-                    for task in self.tags.get(tag, []):
-                        task_item = (task, ())
-                        incidence[task_item] -= 1
-                        if incidence[task_item] == 0:
-                            next_roots.append(task_item)
+                for dep_item in self.get_dependencies(func):
+                    incidence[dep_item] -= 1
+                    if incidence[dep_item] == 0:
+                        next_roots.append(dep_item)
             roots = next_roots
 
         toposort.reverse()
         return toposort
 
     def resolve_depends(self, props):
-        if props['depends']['resolved']:
+        if props.resolved:
             return
 
-        for i in range(len(props['depends']['task'])):
-            task_depends, context = props['depends']['task'][i]
-            if type(task_depends) is str:
-                resolved = self.resolve_str_task(task_depends, context)
-                props['depends']['task'][i] = (resolved, context)
-
-        for i in range(len(props['depends']['cmd'])):
-            value, context = props['depends']['cmd'][i]
-            cmd_depends, cmd_args = value
-            if type(cmd_depends) is str:
-                resolved = self.resolve_str_cmd(cmd_depends, context)
-                if not self.is_signature_compatible(resolved, cmd_args):
-                    self.error(
-                        'Arguments given in @depends are incompatible with the function signature.')
-                    self.show_context(context, 'error')
-                    sys.exit(1)
-                props['depends']['cmd'][i] = ((resolved, cmd_args), context)
+        props.depends_task = [
+            (self.resolve_str_task(task, context)
+             if isinstance(task, str) else task, context)
+            for task, context in props.depends_task]
+
+        props.depends_cmd = [
+            ((self.resolve_str_cmd(cmd, cmd_args, context)
+              if isinstance(cmd, str) else cmd, cmd_args), context)
+            for (cmd, cmd_args), context in props.depends_cmd]
 
-        props['depends']['resolved'] = True
+        items = [cmd_item for cmd_item, _context in props.depends_cmd]
+        items.extend((task, ()) for task, _context in props.depends_task)
+        for tag, _context in props.depends_tag:
+            items.extend((task, ()) for task in self.tags.get(tag, []))
+        props.items = tuple(items)
+
+        props.resolved = True
     
     def resolve_str_task(self, str_task, context):
-        if str_task not in self.tasks:
-            self.error(f'No @task named {str_task}.')
-            self.show_context(context, 'error')
-            self.hint(
-                '(You can reference a function directly, instead of a string.)')
-            self.hint(
-                '(Are you missing a @task somewhere?)')
-            sys.exit(1)
-        elif len(self.tasks[str_task]) > 1:
-            self.error(
-                f'There\'s more than one @task named {str_task}.')
-            self.show_context(context, 'error')
-            self.hint(
-                '(You can reference a function directly, instead of a string.)')
-            self.hint(
-                '(Alternatively, use @tag, and @depends(on_tag=...).)')
-            sys.exit(1)
-        return self.tasks[str_task][0]        
-
-    def resolve_str_cmd(self, str_cmd, context):
-        if str_cmd not in self.cmds:
-            self.error(f'No @cmd named {str_cmd}.')
-            self.show_context(context, 'error')
-            self.hint(
-                '(You can reference a function directly, instead of a string.)')
-            self.hint(
-                '(Are you missing a @cmd somewhere?)')
-            sys.exit(1)
-        return self.cmds[str_cmd]
+        tasks = self.tasks.get(str_task, None)
+        if tasks is None:
+            raise _Sane.Error(
+                f'No @task named {str_task}.', context,
+                ('(You can reference a function directly, instead of a string.)',
+                 '(Are you missing a @task somewhere?)'))
+        elif len(tasks) > 1:
+            raise _Sane.Error(
+                f'There\'s more than one @task named {str_task}.', context,
+                ('(You can reference a function directly, instead of a string.)',
+                 '(Alternatively, use @tag, and @depends(on_tag=...).)'))
+        return tasks[0]
+
+    def resolve_str_cmd(self, str_cmd, cmd_args, context):
+        resolved = self.cmds.get(str_cmd, None)
+        if resolved is None:
+            raise _Sane.Error(
+                f'No @cmd named {str_cmd}.', context,
+                ('(You can reference a function directly, instead of a string.)',
+                 '(Are you missing a @cmd somewhere?)'))
+        if not self.is_signature_compatible(resolved, cmd_args):
+            raise _Sane.Error(
+                'Arguments given in @depends are incompatible with the function signature.',
+                context)
+        return resolved
 
 
     def is_signature_compatible(self, func, args):
-        signature = inspect.signature(func)
-        mandatory_arg_count = 0
-        optional_arg_count = 0
-        for arg in signature.parameters.values():
-            if arg.default is inspect.Parameter.empty:
-                mandatory_arg_count += 1
-            else:
-                optional_arg_count += 1
+        mandatory_arg_count, optional_arg_count = func.__sane__.argcounts
         wrong_number_of_args = (len(args) < mandatory_arg_count or
                                 len(args) > mandatory_arg_count + optional_arg_count)
         return not wrong_number_of_args
 
-    def get_trace(self, stack):
-        trace = []
-        while len(stack) > 0:
-            op, item = stack.pop()
-            if op != 'seal':
-                continue
-            trace.append(item)
-        return trace
+    def get_trace(self, path, loop_item):
+        return path[path.index(loop_item):]
 
     def report_loop(self, trace):
         lines = ['Dependency loop.\n']
-        for element in reversed(trace):
+        for element in trace:
             func, args = element
             name = self.get_name(func)
-            str_args = ', '.join(str(arg) for arg in args)
-            context = func.__sane__['context']
+            str_args = ', '.join([str(arg) for arg in args])
+            context = func.__sane__.context
             lines.append(f'* {name}({str_args})\n')
             for line in self.format_context(context).splitlines():
                 lines.append(f'| {line}\n')
             lines.append('|\n')
 
-        loop_func, loop_args = trace[-1]
-        loop_str_args = ', '.join(str(arg) for arg in args)
+        loop_func, loop_args = trace[0]
+        loop_str_args = ', '.join([str(arg) for arg in loop_args])
         loop_name = self.get_name(loop_func)
-        loop_context = func.__sane__['context']
         lines.append(f'* {loop_name}({loop_str_args})')
 
-        self.error(''.join(lines))
-        sys.exit(1)
+        raise _Sane.Error(''.join(lines))
 
     def get_name(self, func):
+        return func.__sane__.name
+
+    def make_name(self, func):
         if hasattr(func, '__name__'):
             return func.__name__
         else:
-            assert func.__sane__['type'] == 'task'
             return f'(Anonymous Task @ {hex(id(func))})'
     
+    def get_label(self, func, args):
+        item = (func, args)
+        label = self.labels.get(item, None)
+        if label is None:
+            str_args = ', '.join([str(x) for x in args])
+            label = f'{self.get_name(func)}({str_args})'
+            self.labels[item] = label
+        return label
+
     def get_str_args(self, cmd):
-        cmd_args = inspect.signature(cmd).parameters.keys()
-        if len(cmd_args) > 0:
-            return ', '.join(cmd_args)
-        else:
-            return ''
+        return ', '.join(cmd.__sane__.args)
 
     def is_task_or_cmd(self, func):
-        props = self.get_props(func)
-        return props['type'] is not None
+        props = getattr(func, '__sane__', None)
+        return props is not None and props.type is not None
     
     def ensure_not_magic_and_parallel(self):
-        if self.magic and self.thread_exe is not None:
-            self.error('To run sane with a number of jobs different from 1, '
-                      f'call sane.sane() at the end of {self.script_name}.')
-            sys.exit(1)
+        if self.magic and self.jobs != 1:
+            raise _Sane.Error('To run sane with a number of jobs different from 1, '
+                              f'call sane.sane() at the end of {self.script_name}.')
     
     def ensure_no_tags(self, func, context):
         props = self.get_props(func)
-        if not hasattr(func, '__sane__') or not 'tags' in func.__sane__:
-            return
-        if len(func.__sane__['tags']) > 0:
+        if len(props.tags) > 0:
             self.error('@cmds cannot have @tags.')
             self.show_context(context, 'error')
             self.hint('(Use a @task instead.)')
             sys.exit(1)
 
     def ensure_no_args(self, func, context):
-        signature = inspect.signature(func)
-        if len(signature.parameters.values()) > 0:
+        if inspect.signature(func).parameters:
             self.error('@task cannot have arguments.')
             self.show_context(context, 'error')
             self.hint('(Use a @cmd instead.)')
             sys.exit(1)
 
     def ensure_positional_args_only(self, context: Context, func):
-        signature = inspect.signature(func)
-        any_non_positional = any(
-            arg.kind not in (inspect.Parameter.POSITIONAL_ONLY,
-                             inspect.Parameter.POSITIONAL_OR_KEYWORD)
-            for arg in signature.parameters.values())
-        if any_non_positional:
-            self.error('@cmd cannot have non-positional arguments.')
-            self.show_context(context, 'error')
-            sys.exit(1)
+        parameters = inspect.signature(func).parameters
+        mandatory_arg_count = 0
+        for arg in parameters.values():
+            if arg.kind not in _Sane.POSITIONAL_KINDS:
+                self.error('@cmd cannot have non-positional arguments.')
+                self.show_context(context, 'error')
+                sys.exit(1)
+            if arg.default is inspect.Parameter.empty:
+                mandatory_arg_count += 1
+        arg_names = tuple(parameters)
+        return arg_names, (mandatory_arg_count,
+                           len(arg_names) - mandatory_arg_count)
 
     def get_props(self, func):
-        if '__sane__' not in func.__dict__:
-            func.__dict__['__sane__'] = {
-                'type': None,
-                'context': None,
-                'tags': [],
-                'depends': {
-                    'resolved': False,
-                    'tag': [],
-                    'cmd': [],
-                    'task': [],
-                },
-                'incidence': None,
-            }
-
-        return func.__dict__['__sane__']
-
-    def print(self, *args, **kwargs):
-        if self.color:
-            print(*args, **kwargs)
-        else:
-            print(*map(_Sane.strip_ansi, args), **kwargs)
+        props = getattr(func, '__sane__', None)
+        if props is None:
+            props = func.__dict__['__sane__'] = _Sane.Props()
+        return props
 
     def log(self, message):
-        header = '\x1b[2m[log]\x1b[0m'
-        if not self.color:
-            header = _Sane.strip_ansi(header)
-        print(header, message, file=sys.stderr)
+        sys.stderr.write(f'{self.log_header}{message}\n')
 
     def warn(self, message):
-        header = '\x1b[33m[warn]\x1b[0m'
-        if not self.color:
-            header = _Sane.strip_ansi(header)
-        print(header, message, file=sys.stderr)
+        sys.stderr.write(f'{self.warn_header}{message}\n')
 
     def error(self, message):
-        if self.color:
-            message = '\x1b[35m[error] ' + message + '\x1b[0m'
-        print(message, file=sys.stderr)
+        sys.stderr.write(f'{self.error_header}{message}{self.footer}')
 
     def hint(self, message):
-        if self.color:
-            message = '\x1b[2m' + message + '\x1b[0m'
-        print(message, file=sys.stderr)
+        sys.stderr.write(f'{self.hint_header}{message}{self.footer}')
 
     def format_context(self, context: Context):
-        line_ctx = f'\n{context.filename}: l.{context.lineno}'
-        info = []
-        if context.index < context.lineno:
-            info.append('...\n')
-        for i, code_line in enumerate(context.code_context):
-            if i == context.index:
-                info_line = '>  ' + code_line
-            else:
-                info_line = '   ' + code_line
-            info.append(info_line)
-        info = ''.join(info)
-        return f'{line_ctx}\n{info}'
+        filename, lineno = context.filename, context.lineno
+        line_ctx = f'\n{filename}: l.{lineno}'
+        lines = linecache.getlines(filename)
+        start = max(lineno - 3, 0)
+        index = lineno - 1 - start
+        code_lines = lines[start:start + 4]
+        prefixes = ['   '] * len(code_lines)
+        if index < len(prefixes):
+            prefixes[index] = '>  '
+        info = ''.join([prefix + code_line
+                        for prefix, code_line in zip(prefixes, code_lines)])
+        return f'{line_ctx}\n...\n{info}'
 
     def show_context(self, context: Context, style: Literal['log', 'warn', 'error', 'debug']):
+        if style not in self.styles:
+            raise ValueError(
+                f'Expected \'{style}\' to be one of log, warn, error, hint.')
+        pre, post = self.styles[style]
         info = self.format_context(context)
-        if self.color:
-            if style == 'log':
-                print(f'\x1b[2m{info}\x1b[0m', file=sys.stderr)
-            elif style == 'warn':
-                print(f'\x1b[33m{info}\x1b[0m', file=sys.stderr)
-            elif style == 'error':
-                print(f'\x1b[35m{info}\x1b[0m', file=sys.stderr)
-            elif style == 'hint':
-                print(f'\x1b[2m{info}\x1b[0m', file=sys.stderr)
-            else:
-                raise ValueError(
-                    f'Expected \'{style}\' to be one of log, warn, error, hint.')
-        else:
-            print(info, file=sys.stderr)
+        sys.stderr.write(f'{pre}{info}{post}\n')
 
 
 _sane = _Sane.get()
@@ -1873,8 +1969,9 @@ default = _sane.default_decorator
 sane = _sane.main
 
 if __name__ == '__main__':
-    _stateful.log(f'Sane v{_Sane.VERSION}, by Miguel Murça.\n'
-                  'Sane should be imported from other files, '
-                  'not ran directly.\n'
-                  'Refer to the [Github page] for more information.\n'
-                  'https://github.com/mikeevmm/sane')
+    _sane.log(f'{_Sane.VERSION_STRING}, by Miguel Murça.\n'
+              'Sane should be imported from other files, '
+              'not ran directly.\n'
+              'Refer to the [Github page] for more information.\n'
+              'https://github.com/mikeevmm/sane')
+    _sane.finalized = True